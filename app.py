@@ -1,6 +1,12 @@
 import os
-from flask import Flask, request, jsonify, send_from_directory, render_template
-from werkzeug.exceptions import HTTPException
+import json
+import queue
+import threading
+import uuid
+from flask import (Flask, request, jsonify, send_file, render_template,
+                   url_for, session, Response, stream_with_context)
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.security import safe_join
 import grok  # your pipeline functions live here
 
 app = Flask(__name__)
@@ -10,6 +16,11 @@ app.secret_key = "dev"  # local use only
 OUTPUT_DIR = grok.OUTPUT_DIR
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Behind nginx/Apache with X-Sendfile configured, let the web server stream media files
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "0") == "1"
+HEARTBEAT_SECS = 2  # idle gap between SSE keepalives while a render runs
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", "3600"))  # seconds; ETags revalidate after that
+
 
 # ---------------------------- helpers ----------------------------
 def _list_videos():
@@ -21,10 +32,171 @@ def _list_videos():
     return files
 
 
+def _send_media(directory: str, filename: str):
+    """
+    Send a file with byte-range support (206 for seeking), a strong ETag from
+    size + mtime, and public caching. send_file hands the open file to the
+    server's wsgi.file_wrapper, which uses sendfile where the server supports it.
+    """
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+    st = os.stat(path)
+    return send_file(path, conditional=True, etag=f"{st.st_size:x}-{st.st_mtime_ns:x}",
+                     last_modified=st.st_mtime, max_age=MEDIA_MAX_AGE)
+
+
 def _is_https_mp3(u: str) -> bool:
     return isinstance(u, str) and u.lower().startswith("https://") and u.lower().endswith(".mp3")
 
 
+def _audio_url_for(mp3_path: str) -> str:
+    """
+    Browser URL for a TTS reply. Per-reply clips live under OUTPUT_DIR and go through
+    /media, so concurrent sessions each hear their own answer. The shared output.mp3
+    (only returned when the per-reply copy could not be written) falls back to /audio.
+    """
+    try:
+        rel = _media_relpath(mp3_path)
+    except ValueError:  # different drive on Windows
+        rel = ".."
+    if not rel.startswith(".."):
+        return url_for("media", filename=rel)
+    try:
+        version = int(os.path.getmtime(mp3_path))
+    except OSError:
+        version = 0
+    return url_for("audio", v=version)
+
+
+def _media_relpath(path: str) -> str:
+    """Path under OUTPUT_DIR in URL form, for /media links to files in subfolders."""
+    return os.path.relpath(path, OUTPUT_DIR).replace(os.sep, "/")
+
+
+def _chat_session_id() -> str:
+    """Per-browser conversation id (signed cookie). Must be read before a streamed response starts."""
+    if "chat_id" not in session:
+        session["chat_id"] = uuid.uuid4().hex
+    return session["chat_id"]
+
+
+def _full_pipeline_events(question: str, image_url: str, upload: bool, session_id: str = None):
+    """
+    Run Q -> A -> TTS -> Animate and yield (event, payload) pairs as each stage finishes.
+    Failures are yielded as an "error" event carrying an HTTP status, then the generator stops.
+    Shared by /full (collects into one JSON reply) and /full/stream (SSE).
+    """
+    # 0) Pre-rendered FAQ answer (see `python grok.py warm`); unmatched questions fall through.
+    # Once the conversation has history, only an exact match may skip the live, context-aware answer.
+    hit = grok.faq_lookup(question, exact_only=grok.session_has_history(session_id))
+    if hit:
+        grok.remember_turn(session_id, question, hit["answer"])
+        video_rel = _media_relpath(hit["video"])
+        yield "answer", dict(question=question, answer=hit["answer"], faq=True)
+        yield "mp3", dict(mp3=hit["mp3"], url=url_for("media", filename=_media_relpath(hit["mp3"])))
+        yield "video", dict(ok=True, question=question, answer=hit["answer"], mp3=hit["mp3"],
+                            result=hit["video"], basename=video_rel, url=url_for("media", filename=video_rel),
+                            faq=dict(question=hit["question"], score=hit["score"]))
+        return
+
+    # 1) Persona answer
+    try:
+        answer = grok.chat_like_me(question, session_id=session_id)
+    except Exception as e:
+        yield "error", dict(error="GroqException", detail=str(e), status=500)
+        return
+    if not answer:
+        yield "error", dict(error="NoAnswer", detail="No answer from chat_like_me", status=500)
+        return
+    yield "answer", dict(question=question, answer=answer)
+
+    # 2) TTS
+    voice_id = grok.load_voice_id()
+    if not voice_id:
+        yield "error", dict(error="NoVoiceId", detail="Put voice_id.txt next to grok.py or run CLI Option 6", status=400)
+        return
+    try:
+        cleanup = {}
+        mp3_path = grok.generate_tts(voice_id, answer, stats=cleanup)
+    except Exception as e:
+        yield "error", dict(error="TTSException", detail=str(e), status=500)
+        return
+    if not mp3_path:
+        yield "error", dict(error="TTSFailed", detail="generate_tts returned None", status=500)
+        return
+    yield "mp3", dict(mp3=mp3_path, url=_audio_url_for(mp3_path), cleanup=cleanup or None)
+
+    # 3) Choose audio for animation
+    # If user opted to upload, let grok upload the freshly-made MP3, then use the new https URL.
+    # If not uploading, but a valid DEFAULT_AUDIO_URL already exists, use it (D-ID).
+    # Otherwise pass this reply's own MP3 path to force the local FFmpeg render.
+    if upload:
+        try:
+            grok.upload_output_mp3_and_set_default()
+            audio_url = getattr(grok, "DEFAULT_AUDIO_URL", os.getenv("DEFAULT_AUDIO_URL", ""))
+        except Exception:
+            audio_url = ""
+        yield "audio_url", dict(audio_url=audio_url, uploaded=_is_https_mp3(audio_url))
+    else:
+        existing = getattr(grok, "DEFAULT_AUDIO_URL", os.getenv("DEFAULT_AUDIO_URL", ""))
+        audio_url = existing if _is_https_mp3(existing) else ""
+    if not _is_https_mp3(audio_url):
+        audio_url = mp3_path
+
+    # 4) Animate. animate_avatar_did blocks while polling D-ID, so run it on a worker
+    # thread and forward its status callbacks as they arrive.
+    # If the consumer goes away (browser closed the stream), the cancel event stops
+    # any queued/running FFmpeg encode and the D-ID polling loop. While waiting we
+    # yield a "heartbeat" every couple of seconds: the SSE writer turns it into a
+    # comment line, and writing to a closed socket is what raises GeneratorExit here.
+    updates = queue.Queue()
+    outcome = {}
+    cancel = threading.Event()
+
+    def _work():
+        try:
+            with grok.cancellable(cancel):
+                outcome["result"] = grok.animate_avatar_did(
+                    image_url, audio_url, on_status=lambda status, info: updates.put((status, info)))
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            updates.put(None)
+
+    threading.Thread(target=_work, daemon=True).start()
+    try:
+        while True:
+            try:
+                item = updates.get(timeout=HEARTBEAT_SECS)
+            except queue.Empty:
+                yield "heartbeat", {}
+                continue
+            if item is None:
+                break
+            status, info = item
+            yield "did", dict(status=status, **info)
+    except GeneratorExit:
+        cancel.set()
+        raise
+
+    if "error" in outcome:
+        yield "error", dict(error="AnimateException", detail=str(outcome["error"]), status=500)
+        return
+
+    video_result = outcome.get("result")
+    basename = os.path.basename(video_result) if (isinstance(video_result, str) and os.path.exists(video_result)) else None
+    yield "video", dict(ok=bool(video_result), question=question, answer=answer, mp3=mp3_path,
+                        result=video_result, basename=basename,
+                        url=url_for("media", filename=basename) if basename else video_result)
+
+
+def _sse(event: str, payload: dict) -> str:
+    if event == "heartbeat":
+        return ": keepalive\n\n"  # SSE comment; EventSource ignores it
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
 # If anything unexpected happens, return JSON (not an HTML error page)
 @app.errorhandler(Exception)
 def _json_errors(e):
@@ -49,7 +221,36 @@ def index():
 @app.route("/media/<path:filename>")
 def media(filename):
     """Serve generated videos from OUTPUT_DIR so the GUI can play them."""
-    return send_from_directory(OUTPUT_DIR, filename)
+    return _send_media(OUTPUT_DIR, filename)
+
+
+@app.route("/poster/<path:filename>")
+def poster(filename):
+    """
+    Poster JPEG for a video in OUTPUT_DIR. Posters are normally made in the
+    background when the video is written; older videos get theirs made here
+    once, on first request. Failures are remembered, so broken videos 404 fast.
+    """
+    video = safe_join(OUTPUT_DIR, filename)
+    if video is None or not os.path.isfile(video):
+        raise NotFound()
+    poster_path = grok.poster_path_for(video)
+    if not os.path.exists(poster_path) and not grok.make_poster(video):
+        raise NotFound()
+    return _send_media(grok.POSTER_DIR, os.path.basename(poster_path))
+
+
+@app.post("/chat/reset")
+def chat_reset():
+    """Start a fresh conversation: follow-up context for this browser is dropped."""
+    grok.forget_session(session.pop("chat_id", None))
+    return jsonify(ok=True)
+
+
+@app.get("/stats/ffmpeg")
+def ffmpeg_stats():
+    """Encoder pool load: running/queued jobs, thread budget, queue wait and encode times."""
+    return jsonify(ok=True, **grok.ffmpeg_pool_stats())
 
 
 @app.post("/tts")
@@ -66,7 +267,8 @@ def tts():
         return jsonify(ok=False, error="NoVoiceId", detail="Put voice_id.txt next to grok.py or run CLI Option 6"), 400
 
     try:
-        mp3_path = grok.generate_tts(voice_id, text)
+        cleanup = {}
+        mp3_path = grok.generate_tts(voice_id, text, stats=cleanup)
     except Exception as e:
         return jsonify(ok=False, error="TTSException", detail=str(e)), 500
 
@@ -81,7 +283,7 @@ def tts():
             # Don't fail the request if upload fails; just report it
             uploaded_url = None
 
-    return jsonify(ok=True, mp3=mp3_path, uploaded_url=uploaded_url)
+    return jsonify(ok=True, mp3=mp3_path, uploaded_url=uploaded_url, cleanup=cleanup or None)
 
 
 @app.post("/animate")
@@ -89,11 +291,16 @@ def animate():
     data = request.get_json(force=True, silent=True) or {}
     # If blank, use DEFAULT_IMAGE_URL
     image_url = (data.get("image_url") or "").strip() or getattr(grok, "DEFAULT_IMAGE_URL", os.getenv("DEFAULT_IMAGE_URL", ""))
-    # If "", grok.animate_avatar_did will fall back to local output.mp3 (still video)
+    # If "", grok.animate_avatar_did will fall back to a local render of output.mp3
     audio_url = (data.get("audio_url") or "").strip()
+    # local=true skips D-ID and renders the talking head on this machine
+    local = bool(data.get("local", False))
 
     try:
-        result = grok.animate_avatar_did(image_url, audio_url)
+        if local:
+            result = grok.local_avatar_video(image_url, audio_url or grok.OUTPUT_MP3)
+        else:
+            result = grok.animate_avatar_did(image_url, audio_url)
     except Exception as e:
         return jsonify(ok=False, error="AnimateException", detail=str(e)), 500
 
@@ -105,59 +312,64 @@ def animate():
     return jsonify(ok=ok, result=result, basename=basename)
 
 
+@app.route("/audio")
+def audio():
+    """Serve the local TTS output.mp3 so the GUI can play it before the video is ready."""
+    if not os.path.exists(grok.OUTPUT_MP3):
+        return jsonify(ok=False, error="NotFound", detail="No output.mp3 yet"), 404
+    return send_file(grok.OUTPUT_MP3, mimetype="audio/mpeg", max_age=0)
+
+
+def _full_args(data):
+    question = (data.get("question") or "").strip()
+    image_url = (data.get("image_url") or "").strip() or getattr(grok, "DEFAULT_IMAGE_URL", os.getenv("DEFAULT_IMAGE_URL", ""))
+    return question, image_url
+
+
 @app.post("/full")
 def full():
     data = request.get_json(force=True, silent=True) or {}
-    question = (data.get("question") or "").strip()
+    question, image_url = _full_args(data)
     upload = bool(data.get("upload", True))
-    image_url = (data.get("image_url") or "").strip() or getattr(grok, "DEFAULT_IMAGE_URL", os.getenv("DEFAULT_IMAGE_URL", ""))
 
     if not question:
         return jsonify(ok=False, error="BadRequest", detail="Question is empty"), 400
 
-    # 1) Persona answer
-    try:
-        answer = grok.chat_like_me(question)
-    except Exception as e:
-        return jsonify(ok=False, error="GroqException", detail=str(e)), 500
-    if not answer:
-        return jsonify(ok=False, error="NoAnswer", detail="No answer from chat_like_me"), 500
+    for event, payload in _full_pipeline_events(question, image_url, upload, _chat_session_id()):
+        if event == "error":
+            status = payload.pop("status", 500)
+            return jsonify(ok=False, **payload), status
+        if event == "video":
+            payload.pop("url", None)
+            return jsonify(**payload)
+    return jsonify(ok=False, error="NoResult", detail="Pipeline ended without a video"), 500
+
+
+@app.get("/full/stream")
+def full_stream():
+    """
+    Same pipeline as /full, but as Server-Sent Events (EventSource needs GET, so
+    the inputs come from the query string). Events: answer, mp3, audio_url, did,
+    video, error, then a final "end" so the client can close the connection.
+    """
+    question, image_url = _full_args(request.args)
+    upload = request.args.get("upload", "1").lower() not in ("0", "false", "no", "")
 
-    # 2) TTS
-    voice_id = grok.load_voice_id()
-    if not voice_id:
-        return jsonify(ok=False, error="NoVoiceId", detail="Put voice_id.txt next to grok.py or run CLI Option 6"), 400
-    try:
-        mp3_path = grok.generate_tts(voice_id, answer)
-    except Exception as e:
-        return jsonify(ok=False, error="TTSException", detail=str(e)), 500
-    if not mp3_path:
-        return jsonify(ok=False, error="TTSFailed", detail="generate_tts returned None"), 500
-
-    # 3) Choose audio for animation
-    # If user opted to upload, let grok upload the freshly-made MP3, then use the new https URL.
-    # If not uploading, but a valid DEFAULT_AUDIO_URL already exists, use it (D-ID).
-    # Otherwise pass "" to force local FFmpeg still-video fallback.
-    if upload:
-        try:
-            grok.upload_output_mp3_and_set_default()
-            audio_url = getattr(grok, "DEFAULT_AUDIO_URL", os.getenv("DEFAULT_AUDIO_URL", ""))
-        except Exception:
-            audio_url = ""
-    else:
-        existing = getattr(grok, "DEFAULT_AUDIO_URL", os.getenv("DEFAULT_AUDIO_URL", ""))
-        audio_url = existing if _is_https_mp3(existing) else ""
+    if not question:
+        return jsonify(ok=False, error="BadRequest", detail="Question is empty"), 400
 
-    # 4) Animate
-    try:
-        video_result = grok.animate_avatar_did(image_url, audio_url)
-    except Exception as e:
-        return jsonify(ok=False, error="AnimateException", detail=str(e)), 500
+    session_id = _chat_session_id()
 
-    basename = os.path.basename(video_result) if (isinstance(video_result, str) and os.path.exists(video_result)) else None
+    def _stream():
+        try:
+            for event, payload in _full_pipeline_events(question, image_url, upload, session_id):
+                yield _sse(event, payload)
+        except Exception as e:
+            yield _sse("error", dict(error=e.__class__.__name__, detail=str(e), status=500))
+        yield _sse("end", {})
 
-    return jsonify(ok=bool(video_result), question=question, answer=answer,
-                   mp3=mp3_path, result=video_result, basename=basename)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(_stream()), mimetype="text/event-stream", headers=headers)
 
 
 if __name__ == "__main__":
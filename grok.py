@@ -3,7 +3,7 @@
 Virtual avatar pipeline
 - Persona chat via Groq
 - TTS via ElevenLabs (writes output.mp3 next to this file)
-- Animation via D-ID (or local FFmpeg still-image fallback)
+- Animation via D-ID (or a local NumPy/FFmpeg talking head, with a still-image fallback)
 - Optional: upload output.mp3 to a GitHub Release to get a public HTTPS .mp3
 
 Notes:
@@ -12,12 +12,21 @@ Notes:
 """
 
 import os
+import sys
+import json
 import time
 import base64
+import hashlib
 import requests
 import subprocess
 import tempfile
 import shutil
+import threading
+import difflib
+import unicodedata
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
 from datetime import datetime
 from dotenv import load_dotenv
 from requests.adapters import HTTPAdapter
@@ -43,6 +52,8 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 VOICE_ID_PATH     = os.path.join(BASE_DIR, "voice_id.txt")
 OUTPUT_MP3        = os.path.join(BASE_DIR, "output.mp3")            # local TTS target
 VOICE_SAMPLE_PATH = os.path.join(BASE_DIR, "voice cloning.mp3")     # sample for cloning
+VOICE_SAMPLES_DIR = os.path.join(BASE_DIR, "voice_samples")         # extra samples (optional)
+VOICE_REGISTRY_PATH = os.path.join(BASE_DIR, "voice_registry.json") # sample-set hash -> voice id
 
 # Keys / tokens
 GROQ_API_KEY       = os.getenv("GROQ_API_KEY")
@@ -121,12 +132,30 @@ def vpn_session():
 # --------------------------------------------------------------------
 # Helpers
 # --------------------------------------------------------------------
+# Active voice id, kept in memory so the request path never touches disk
+_VOICE_ID = None
+_VOICE_LOCK = threading.Lock()
+
 def load_voice_id():
-    if os.path.exists(VOICE_ID_PATH):
-        vid = open(VOICE_ID_PATH, "r", encoding="utf-8").read().strip()
-        print("voice_id:", vid)
-        return vid
-    print(f"voice_id.txt not found at {VOICE_ID_PATH}.")
+    """
+    Return the active ElevenLabs voice id.
+    Read once from the voice registry (or the legacy voice_id.txt), then served from memory.
+    """
+    global _VOICE_ID
+    if _VOICE_ID:
+        return _VOICE_ID
+    with _VOICE_LOCK:
+        if _VOICE_ID:
+            return _VOICE_ID
+        vid = _load_voice_registry().get("active")
+        if not vid and os.path.exists(VOICE_ID_PATH):
+            with open(VOICE_ID_PATH, "r", encoding="utf-8") as f:
+                vid = f.read().strip()
+        if vid:
+            _VOICE_ID = vid
+            print("voice_id:", vid)
+            return vid
+    print(f"No voice registered in {VOICE_REGISTRY_PATH} and voice_id.txt not found at {VOICE_ID_PATH}.")
     return None
 
 def set_elevenlabs_key_runtime(new_key: str):
@@ -144,21 +173,167 @@ def _timestamp():
 # --------------------------------------------------------------------
 # Phase 1: Voice cloning (ElevenLabs)
 # --------------------------------------------------------------------
-def clone_voice(name="MyVoice"):
+AUDIO_SAMPLE_EXTS = (".mp3", ".wav", ".m4a", ".ogg", ".flac")
+
+def _voice_samples():
+    """The sample set: 'voice cloning.mp3' plus any audio files in voice_samples/."""
+    paths = []
+    if os.path.exists(VOICE_SAMPLE_PATH):
+        paths.append(VOICE_SAMPLE_PATH)
+    if os.path.isdir(VOICE_SAMPLES_DIR):
+        for name in sorted(os.listdir(VOICE_SAMPLES_DIR)):
+            if name.lower().endswith(AUDIO_SAMPLE_EXTS):
+                paths.append(os.path.join(VOICE_SAMPLES_DIR, name))
+    return paths
+
+def _sample_set_hash(paths) -> str:
+    """
+    Hash of the sample contents, read in chunks. Per-file digests are sorted first,
+    so renaming or reordering samples does not count as a change.
+    """
+    digests = []
+    for path in paths:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digests.append(h.hexdigest())
+    return hashlib.sha256("\n".join(sorted(digests)).encode()).hexdigest()
+
+def _load_voice_registry() -> dict:
+    if not os.path.exists(VOICE_REGISTRY_PATH):
+        return {"active": None, "voices": {}}
+    try:
+        with open(VOICE_REGISTRY_PATH, "r", encoding="utf-8") as f:
+            reg = json.load(f)
+    except (OSError, ValueError) as e:
+        print("Could not read voice registry:", e)
+        return {"active": None, "voices": {}}
+    reg.setdefault("active", None)
+    reg.setdefault("voices", {})
+    return reg
+
+def _save_voice_registry(reg: dict):
+    tmp = VOICE_REGISTRY_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(reg, f, indent=2)
+    os.replace(tmp, VOICE_REGISTRY_PATH)
+
+def _activate_voice(reg: dict, voice_id: str):
+    global _VOICE_ID
+    reg["active"] = voice_id
+    _save_voice_registry(reg)
+    with _VOICE_LOCK:
+        _VOICE_ID = voice_id
+
+class _MultipartFiles:
+    """
+    multipart/form-data body that reads sample files from disk as it is sent,
+    so several long samples go up in one request without being held in memory.
+    Has __len__ (for Content-Length) and tell/seek(0) so urllib3 retries can rewind.
+    """
+
+    def __init__(self, fields: dict, field_name: str, paths):
+        self.boundary = f"avatar-{os.urandom(12).hex()}"
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts = []
+        for key, value in fields.items():
+            self._parts.append((
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'
+                f"{value}\r\n").encode())
+        for path in paths:
+            fname = os.path.basename(path).replace('"', "")
+            self._parts.append((
+                f'--{self.boundary}\r\nContent-Disposition: form-data; name="{field_name}"; '
+                f'filename="{fname}"\r\nContent-Type: application/octet-stream\r\n\r\n').encode())
+            self._parts.append(path)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode())
+        self._len = sum(len(p) if isinstance(p, bytes) else os.path.getsize(p) for p in self._parts)
+        self.seek(0)
+
+    def __len__(self):
+        return self._len
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise OSError("multipart body can only rewind to the start")
+        self.close()
+        self._index, self._buf, self._pos = 0, b"", 0
+        return 0
+
+    def close(self):
+        fh = getattr(self, "_fh", None)
+        if fh:
+            fh.close()
+        self._fh = None
+
+    def read(self, size=-1):
+        size = self._len if size is None or size < 0 else size
+        out = []
+        want = size
+        while want > 0:
+            if self._fh:
+                chunk = self._fh.read(want)
+                if chunk:
+                    out.append(chunk)
+                    want -= len(chunk)
+                    continue
+                self.close()
+                self._index += 1
+                continue
+            if self._buf:
+                chunk, self._buf = self._buf[:want], self._buf[want:]
+                out.append(chunk)
+                want -= len(chunk)
+                if not self._buf:
+                    self._index += 1
+                continue
+            if self._index >= len(self._parts):
+                break
+            part = self._parts[self._index]
+            if isinstance(part, bytes):
+                self._buf = part
+            else:
+                self._fh = open(part, "rb")
+        data = b"".join(out)
+        self._pos += len(data)
+        return data
+
+def clone_voice(name="MyVoice", force=False):
+    """
+    Clone the voice from the current sample set, or reuse the voice already cloned
+    from exactly these samples (looked up by content hash in voice_registry.json).
+    force=True clones again even if the samples are unchanged.
+    """
+    samples = _voice_samples()
+    if not samples:
+        print(f"No samples found: {VOICE_SAMPLE_PATH} or {VOICE_SAMPLES_DIR}")
+        return None
+
+    key = _sample_set_hash(samples)
+    reg = _load_voice_registry()
+    known = reg["voices"].get(key)
+    if known and not force:
+        _activate_voice(reg, known["voice_id"])
+        print(f"Samples unchanged; reusing voice {known['voice_id']} ({known.get('name')})")
+        return known["voice_id"]
+
     if not ELEVENLABS_API_KEY:
         print("Missing ELEVENLABS_API_KEY")
         return None
-    if not os.path.exists(VOICE_SAMPLE_PATH):
-        print(f"Sample not found: {VOICE_SAMPLE_PATH}")
-        return None
 
     url = "https://api.elevenlabs.io/v1/voices/add"
-    files = {"files": open(VOICE_SAMPLE_PATH, "rb")}
-    data  = {"name": name, "description": "Cloned voice for avatar"}
+    body = _MultipartFiles({"name": name, "description": "Cloned voice for avatar"}, "files", samples)
+    print(f"Uploading {len(samples)} sample(s), {len(body)} bytes")
 
     s = vpn_session()
     try:
-        r = s.post(url, headers={"xi-api-key": ELEVENLABS_API_KEY}, data=data, files=files, timeout=90)
+        r = s.post(url, headers={"xi-api-key": ELEVENLABS_API_KEY, "Content-Type": body.content_type},
+                   data=body, timeout=90)
     except requests.exceptions.SSLError as e:
         print("TLS/VPN error reaching ElevenLabs.")
         print(e)
@@ -166,11 +341,19 @@ def clone_voice(name="MyVoice"):
     except requests.exceptions.RequestException as e:
         print("Network error cloning voice:", e)
         return None
-
-    if r.ok and r.json().get("voice_id"):
-        voice_id = r.json()["voice_id"]
-        open(VOICE_ID_PATH, "w", encoding="utf-8").write(voice_id)
-        print(f"Voice cloned and saved: {voice_id}")
+    finally:
+        body.close()
+
+    voice_id = r.json().get("voice_id") if r.ok else None
+    if voice_id:
+        reg["voices"][key] = {
+            "voice_id": voice_id,
+            "name": name,
+            "samples": [os.path.basename(p) for p in samples],
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+        _activate_voice(reg, voice_id)
+        print(f"Voice cloned and registered: {voice_id}")
         return voice_id
 
     print("Clone error:", r.status_code, (r.text or "")[:400])
@@ -203,26 +386,130 @@ try:
 except Exception:
     groq_client = None
 
-def chat_like_me(prompt):
+# Conversation memory: per session, bounded by an estimated token budget so the
+# prompt (and Groq latency) stays flat however long a session runs. Turns that no
+# longer fit are folded into a short "earlier topics" note instead of being sent in full.
+CHAT_HISTORY_TOKENS = int(os.getenv("CHAT_HISTORY_TOKENS", "1200"))
+CHAT_SUMMARY_TOKENS = 200
+CHAT_MAX_SESSIONS   = 200
+CHAT_SESSION_TTL    = 6 * 3600  # seconds idle before a session is forgotten
+
+_SESSIONS = OrderedDict()
+_SESSIONS_LOCK = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _persona_prefix():
+    """
+    The persona system prompt, built once. It is always the first message and
+    byte-identical across calls, so provider-side prompt caching can reuse it.
+    """
+    return build_persona_prompt()
+
+def _estimate_tokens(text: str) -> int:
+    # Rough but stable: about 4 characters per token for English text
+    return len(text or "") // 4 + 1
+
+def _get_session(session_id: str) -> dict:
+    now = time.time()
+    with _SESSIONS_LOCK:
+        for sid in [k for k, v in _SESSIONS.items() if now - v["seen"] > CHAT_SESSION_TTL]:
+            del _SESSIONS[sid]
+        sess = _SESSIONS.get(session_id)
+        if sess is None:
+            sess = {"turns": deque(), "notes": deque(), "tokens": 0, "note_tokens": 0, "seen": now}
+            _SESSIONS[session_id] = sess
+            while len(_SESSIONS) > CHAT_MAX_SESSIONS:
+                _SESSIONS.popitem(last=False)
+        _SESSIONS.move_to_end(session_id)
+        sess["seen"] = now
+        return sess
+
+def _fold_oldest_turn(sess: dict):
+    """Drop the oldest turn, keeping a one-line note of what was asked."""
+    user, assistant, tokens = sess["turns"].popleft()
+    sess["tokens"] -= tokens
+    question = " ".join(user.split())
+    note = "- Asked: " + (question[:120] + "..." if len(question) > 120 else question)
+    sess["notes"].append((note, _estimate_tokens(note)))
+    sess["note_tokens"] += sess["notes"][-1][1]
+    while sess["note_tokens"] > CHAT_SUMMARY_TOKENS and sess["notes"]:
+        sess["note_tokens"] -= sess["notes"].popleft()[1]
+
+def remember_turn(session_id: str, user: str, assistant: str):
+    """Add a finished exchange to a session and trim it back under the budget."""
+    if not session_id:
+        return
+    sess = _get_session(session_id)
+    with _SESSIONS_LOCK:
+        tokens = _estimate_tokens(user) + _estimate_tokens(assistant)
+        sess["turns"].append((user, assistant, tokens))
+        sess["tokens"] += tokens
+        while sess["tokens"] > CHAT_HISTORY_TOKENS and sess["turns"]:
+            _fold_oldest_turn(sess)
+
+def session_has_history(session_id: str) -> bool:
+    """True if the session already has turns (follow-ups depend on them)."""
+    if not session_id:
+        return False
+    with _SESSIONS_LOCK:
+        sess = _SESSIONS.get(session_id)
+        return bool(sess and (sess["turns"] or sess["notes"]))
+
+def forget_session(session_id: str):
+    with _SESSIONS_LOCK:
+        _SESSIONS.pop(session_id, None)
+
+def _session_messages(session_id: str):
+    """Messages between the persona prefix and the new question."""
+    if not session_id:
+        return []
+    sess = _get_session(session_id)
+    with _SESSIONS_LOCK:
+        msgs = []
+        if sess["notes"]:
+            notes = "\n".join(n for n, _ in sess["notes"])
+            msgs.append({"role": "system", "content": "Earlier in this conversation (condensed):\n" + notes})
+        for user, assistant, _ in sess["turns"]:
+            msgs.append({"role": "user", "content": user})
+            msgs.append({"role": "assistant", "content": assistant})
+        return msgs
+
+def chat_like_me(prompt, session_id=None):
+    """
+    Answer in the persona. With a session_id, recent turns of that session are
+    included (within CHAT_HISTORY_TOKENS) and this exchange is remembered.
+    """
     if not groq_client:
         return "Missing GROQ_API_KEY (or groq package)."
-    system_msg = build_persona_prompt()
-    msgs = [
-        {"role": "system", "content": system_msg},
-        {"role": "user", "content": prompt}
-    ]
+    msgs = [{"role": "system", "content": _persona_prefix()}]
+    msgs += _session_messages(session_id)
+    msgs.append({"role": "user", "content": prompt})
+
+    started = time.time()
     resp = groq_client.chat.completions.create(
         model="llama3-8b-8192",
         messages=msgs,
         temperature=0.4,
         max_tokens=512
     )
-    return resp.choices[0].message.content
+    answer = resp.choices[0].message.content
+    if session_id:
+        est = sum(_estimate_tokens(m["content"]) for m in msgs)
+        print(f"Groq: ~{est} prompt tokens, {len(msgs)} messages, {time.time() - started:.2f}s")
+        remember_turn(session_id, prompt, answer)
+    return answer
 
 # --------------------------------------------------------------------
 # Phase 3: TTS (ElevenLabs)
 # --------------------------------------------------------------------
-def generate_tts(voice_id, text):
+def generate_tts(voice_id, text, stats=None):
+    """
+    Speak `text` and return the path of this reply's own MP3, or None.
+    The returned file is content-addressed under TTS_CACHE_DIR, so concurrent
+    callers never see each other's audio; OUTPUT_MP3 is also updated for the
+    CLI and the GitHub upload. Pass a dict as stats to receive this clip's
+    cleanup numbers (seconds trimmed, gain); it stays empty when cleanup did not run.
+    """
     if not ELEVENLABS_API_KEY:
         print("Missing ELEVENLABS_API_KEY")
         return None
@@ -250,10 +537,16 @@ def generate_tts(voice_id, text):
         return None
 
     if r.ok:
-        with open(OUTPUT_MP3, "wb") as f:
-            f.write(r.content)
-        print(f"TTS audio saved: {OUTPUT_MP3} ({len(r.content)} bytes)")
-        return OUTPUT_MP3
+        clip, cleanup = _store_tts_audio(r.content)
+        if clip is None:
+            with open(OUTPUT_MP3, "wb") as f:
+                f.write(r.content)
+            clip = _keep_raw_tts_clip(r.content)
+        elif stats is not None:
+            stats.update(cleanup)
+        print(f"TTS audio saved: {OUTPUT_MP3} ({len(r.content)} bytes from ElevenLabs)")
+        # Fall back to the shared file only if the per-reply copy could not be written
+        return clip or OUTPUT_MP3
 
     print("TTS error:", r.status_code, (r.text or "")[:400])
     return None
@@ -261,6 +554,179 @@ def generate_tts(voice_id, text):
 # --------------------------------------------------------------------
 # FFmpeg utilities
 # --------------------------------------------------------------------
+def _usable_cores() -> int:
+    try:
+        return max(1, len(os.sched_getaffinity(0)))
+    except AttributeError:  # not available on Windows/macOS
+        return max(1, os.cpu_count() or 1)
+
+# Encodes share the machine: at most FFMPEG_MAX_JOBS run at once, each with an
+# explicit -threads budget, and the rest wait in FIFO order. Without this every
+# libx264 process grabs all cores and concurrent renders slow each other down.
+CPU_CORES         = _usable_cores()
+FFMPEG_MAX_JOBS   = int(os.getenv("FFMPEG_MAX_JOBS", "0")) or max(1, min(4, CPU_CORES // 2))
+FFMPEG_THREADS    = int(os.getenv("FFMPEG_THREADS", "0")) or max(1, CPU_CORES // FFMPEG_MAX_JOBS)
+FFMPEG_TIMEOUT    = float(os.getenv("FFMPEG_TIMEOUT", "600"))  # seconds; applies to queue wait and encode separately
+
+# Per-thread cancel flag, set by callers (e.g. the GUI when the browser disconnects)
+_job_ctx = threading.local()
+
+@contextmanager
+def cancellable(event: threading.Event):
+    """Encodes and D-ID polling started inside this block stop once `event` is set."""
+    previous = getattr(_job_ctx, "cancel", None)
+    _job_ctx.cancel = event
+    try:
+        yield event
+    finally:
+        _job_ctx.cancel = previous
+
+def _cancelled() -> bool:
+    event = getattr(_job_ctx, "cancel", None)
+    return bool(event and event.is_set())
+
+class FFmpegPool:
+    """
+    Bounded FFmpeg runner: a FIFO queue in front of `max_jobs` encoder slots.
+    run() returns a dict with status ("ok", "failed", "timeout", "cancelled"),
+    returncode, stderr, wait_secs (time queued) and encode_secs.
+    """
+
+    def __init__(self, max_jobs: int, threads_per_job: int):
+        self.max_jobs = max_jobs
+        self.threads_per_job = threads_per_job
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue = deque()
+        self._totals = {"jobs": 0, "failed": 0, "timeout": 0, "cancelled": 0,
+                        "wait_secs": 0.0, "encode_secs": 0.0, "max_wait_secs": 0.0}
+
+    def _acquire(self, cancel, deadline):
+        ticket = object()
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while self._queue[0] is not ticket or self._active >= self.max_jobs:
+                    if cancel is not None and cancel.is_set():
+                        return "cancelled"
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return "timeout"
+                    self._cond.wait(min(0.25, remaining))
+                self._active += 1
+                return None
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _record(self, result):
+        with self._cond:
+            t = self._totals
+            t["jobs"] += 1
+            if result["status"] in ("failed", "timeout", "cancelled"):
+                t[result["status"]] += 1
+            t["wait_secs"] += result["wait_secs"]
+            t["encode_secs"] += result["encode_secs"]
+            t["max_wait_secs"] = max(t["max_wait_secs"], result["wait_secs"])
+        return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            t = dict(self._totals)
+            running, queued = self._active, len(self._queue)
+        jobs = max(t["jobs"], 1)
+        t["wait_secs"], t["encode_secs"] = round(t["wait_secs"], 3), round(t["encode_secs"], 3)
+        t["max_wait_secs"] = round(t["max_wait_secs"], 3)
+        return dict(t, running=running, queued=queued, max_jobs=self.max_jobs,
+                    threads_per_job=self.threads_per_job, cores=CPU_CORES,
+                    avg_wait_secs=round(t["wait_secs"] / jobs, 3),
+                    avg_encode_secs=round(t["encode_secs"] / jobs, 3))
+
+    def run(self, args, feed=None, timeout: float = None, queue_timeout: float = None,
+            label: str = "ffmpeg") -> dict:
+        """
+        Run one FFmpeg command. The last arg must be the output path; the thread
+        budget is inserted just before it. `feed` is an optional iterable of bytes
+        written to stdin. `timeout` limits the encode itself and `queue_timeout` the
+        wait for a slot (both default to FFMPEG_TIMEOUT), so a short job queued
+        behind a long render is not timed out before it starts. The caller's
+        cancellable() event is honored while queued and while encoding.
+        """
+        cancel = getattr(_job_ctx, "cancel", None)
+        queued_at = time.monotonic()
+
+        status = self._acquire(cancel, queued_at + (queue_timeout or FFMPEG_TIMEOUT))
+        wait_secs = time.monotonic() - queued_at
+        if status:
+            print(f"FFmpeg {label}: {status} after {wait_secs:.1f}s in queue")
+            return self._record(dict(status=status, returncode=None, stderr="",
+                                     wait_secs=wait_secs, encode_secs=0.0))
+
+        args = list(args[:-1]) + ["-threads", str(self.threads_per_job), args[-1]]
+        print("Running FFmpeg:", " ".join(f'"{a}"' if " " in a else a for a in args))
+        started = time.monotonic()
+        deadline = started + (timeout or FFMPEG_TIMEOUT)
+        stopped = {"reason": None}
+        finished = threading.Event()
+        try:
+            # stderr goes to a temp file so a chatty encoder can never block our writes to stdin
+            with tempfile.TemporaryFile() as err:
+                p = subprocess.Popen(args, stdin=subprocess.PIPE if feed is not None else subprocess.DEVNULL,
+                                     stdout=subprocess.DEVNULL, stderr=err)
+
+                def _watchdog():
+                    while not finished.wait(0.25):
+                        if cancel is not None and cancel.is_set():
+                            stopped["reason"] = "cancelled"
+                        elif time.monotonic() > deadline:
+                            stopped["reason"] = "timeout"
+                        if stopped["reason"]:
+                            p.kill()
+                            return
+
+                threading.Thread(target=_watchdog, daemon=True).start()
+                if feed is not None:
+                    try:
+                        for chunk in feed:
+                            p.stdin.write(chunk)
+                    except (BrokenPipeError, OSError):
+                        pass
+                    finally:
+                        try:
+                            p.stdin.close()
+                        except OSError:
+                            pass
+                rc = p.wait()
+                finished.set()
+                err.seek(0)
+                stderr = err.read().decode(errors="replace")
+        finally:
+            finished.set()
+            self._release()
+
+        encode_secs = time.monotonic() - started
+        status = stopped["reason"] or ("ok" if rc == 0 else "failed")
+        if stopped["reason"] and os.path.exists(args[-1]):
+            # A killed encode leaves a truncated file; don't let it look like a result
+            try:
+                os.remove(args[-1])
+            except OSError:
+                pass
+        print(f"FFmpeg {label}: {status}, waited {wait_secs:.1f}s, encoded {encode_secs:.1f}s "
+              f"({self.threads_per_job} threads)")
+        return self._record(dict(status=status, returncode=rc, stderr=stderr,
+                                 wait_secs=wait_secs, encode_secs=encode_secs))
+
+_FFMPEG_POOL = FFmpegPool(FFMPEG_MAX_JOBS, FFMPEG_THREADS)
+
+def ffmpeg_pool_stats() -> dict:
+    return _FFMPEG_POOL.stats()
+
 _PLACEHOLDER_PNG_B64 = (
     # 1x1 transparent PNG (base64)
     "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR4nGMAAQAABQAB"
@@ -311,6 +777,69 @@ def _ffmpeg_output_path(kind: str = "still") -> str:
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
     return os.path.join(OUTPUT_DIR, f"{kind}_{ts}.mp4")
 
+# Poster thumbnails for the Recent Videos panel, made in the background once a
+# video is written. Grabbing one frame is cheap, so it runs outside the encoder
+# pool with a single thread and never waits behind (or delays) a render.
+POSTER_DIR     = os.path.join(OUTPUT_DIR, "posters")
+POSTER_WIDTH   = 480
+POSTER_TIMEOUT = 30  # seconds per extraction attempt
+
+def poster_path_for(video_path: str) -> str:
+    return os.path.join(POSTER_DIR, os.path.splitext(os.path.basename(video_path))[0] + ".jpg")
+
+def _poster_failed_marker(video_path: str) -> str:
+    return poster_path_for(video_path) + ".failed"
+
+def poster_failed(video_path: str) -> bool:
+    """True if extraction already failed for this version of the video (don't retry every page load)."""
+    marker = _poster_failed_marker(video_path)
+    try:
+        return os.path.getmtime(marker) >= os.path.getmtime(video_path)
+    except OSError:
+        return False
+
+def make_poster(video_path: str, overwrite: bool = False):
+    """Extract a small JPEG frame for a video. Returns the poster path, or None."""
+    out = poster_path_for(video_path)
+    if not overwrite and (os.path.exists(out) or poster_failed(video_path)):
+        return out if os.path.exists(out) else None
+    os.makedirs(POSTER_DIR, exist_ok=True)
+    # Unique temp name: the background hook and /poster may race on the same video
+    tmp = f"{out}.{os.getpid()}-{threading.get_ident()}.part"
+    try:
+        # A frame half a second in avoids black first frames; very short clips use frame 0
+        for seek in ("0.5", "0"):
+            args = ["ffmpeg", "-y", "-v", "error", "-ss", seek, "-i", video_path, "-frames:v", "1",
+                    "-vf", f"scale='min({POSTER_WIDTH},iw)':-2", "-q:v", "4",
+                    "-threads", "1", "-f", "mjpeg", tmp]
+            try:
+                p = subprocess.run(args, capture_output=True, timeout=POSTER_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                continue
+            if p.returncode == 0 and os.path.exists(tmp) and os.path.getsize(tmp) > 0:
+                os.replace(tmp, out)
+                _remove_quietly(_poster_failed_marker(video_path))
+                return out
+    except OSError as e:
+        print("Poster:", e)
+    finally:
+        _remove_quietly(tmp)
+
+    if not os.path.exists(video_path):
+        return None  # moved or deleted meanwhile (e.g. into FAQ_DIR); nothing to mark
+    print("Could not make poster for", video_path)
+    try:
+        with open(_poster_failed_marker(video_path), "w", encoding="utf-8"):
+            pass
+    except OSError:
+        pass
+    return None
+
+def _finished_video(path: str) -> str:
+    """Hook for every MP4 we write into OUTPUT_DIR: start its poster, return without waiting."""
+    threading.Thread(target=make_poster, args=(path,), kwargs={"overwrite": True}, daemon=True).start()
+    return path
+
 def _run_ffmpeg(img_in: str, aud_in: str, out_path: str) -> bool:
     """
     Build FFmpeg args as a list to avoid quoting problems on Windows.
@@ -333,12 +862,11 @@ def _run_ffmpeg(img_in: str, aud_in: str, out_path: str) -> bool:
         "-shortest",
         out_path,
     ]
-    print("Running FFmpeg:", " ".join(f'"{a}"' if " " in a else a for a in args))
-    p = subprocess.run(args, capture_output=True, text=True)
-    if p.returncode == 0 and os.path.exists(out_path):
+    job = _FFMPEG_POOL.run(args, label="still")
+    if job["status"] == "ok" and os.path.exists(out_path):
         return True
-    print("FFmpeg failed (return code", p.returncode, "):")
-    print((p.stderr or "")[:2000])
+    print("FFmpeg failed (", job["status"], "return code", job["returncode"], "):")
+    print(job["stderr"][:2000])
     return False
 
 # --------------------------------------------------------------------
@@ -367,7 +895,7 @@ def fallback_ffmpeg_still_video(image_url_https: str, mp3_path_or_url: str, out_
         # Try FFmpeg directly with the URL/path
         if _run_ffmpeg(img, local_audio, out_path):
             print("Still video:", out_path)
-            return out_path
+            return _finished_video(out_path)
 
         # If it's a URL, try downloading to a temp file
         local_img = None
@@ -376,7 +904,7 @@ def fallback_ffmpeg_still_video(image_url_https: str, mp3_path_or_url: str, out_
                 local_img = _download_to_temp(img, suffix=os.path.splitext(img)[1] or ".png")
                 if _run_ffmpeg(local_img, local_audio, out_path):
                     print("Still video:", out_path)
-                    return out_path
+                    return _finished_video(out_path)
         except requests.exceptions.RequestException as e:
             print(f"Image download failed: {e}")
         finally:
@@ -389,6 +917,403 @@ def fallback_ffmpeg_still_video(image_url_https: str, mp3_path_or_url: str, out_
     print("Could not create still video.")
     return None
 
+# --------------------------------------------------------------------
+# Local talking-head renderer (NumPy + FFmpeg, CPU only)
+# --------------------------------------------------------------------
+# The mouth is not detected; it is a box given as fractions of the image:
+# "center_x,center_y,width,height". The default suits a centered head-and-shoulders
+# portrait. Override with AVATAR_MOUTH_BOX in .env if the jaw moves in the wrong place.
+AVATAR_MOUTH_BOX  = os.getenv("AVATAR_MOUTH_BOX", "0.5,0.62,0.18,0.06")
+TALKING_FPS       = 25
+TALKING_LEVELS    = 6      # precomputed mouth states, closed -> wide open
+TALKING_MAX_WIDTH = 720    # larger portraits are scaled down before rendering
+AUDIO_SAMPLE_RATE = 16000  # envelope analysis rate (mono)
+
+try:
+    import numpy as np
+except Exception:
+    np = None
+
+def _ffmpeg_decode_image(img_in: str):
+    """Decode the first frame of an image path/URL to an RGB uint8 array (H, W, 3) via PPM."""
+    vf = f"scale='2*trunc(min(iw,{TALKING_MAX_WIDTH})/2)':-2"
+    # rgb24 is forced: 16-bit sources (e.g. 48-bit PNGs) would otherwise come out as rgb48 PPM
+    args = ["ffmpeg", "-v", "error", "-i", img_in, "-frames:v", "1", "-vf", vf,
+            "-pix_fmt", "rgb24", "-f", "image2pipe", "-vcodec", "ppm", "-"]
+    try:
+        p = subprocess.run(args, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        # A stalled https image must not hang the render thread forever
+        raise RuntimeError(f"Image decode timed out after {FFMPEG_TIMEOUT:.0f}s: {img_in}")
+    if p.returncode != 0 or not p.stdout.startswith(b"P6"):
+        raise RuntimeError(f"Could not decode image: {(p.stderr or b'').decode(errors='replace')[:300]}")
+    # PPM header: "P6" <ws> width <ws> height <ws> maxval <single ws> pixels
+    fields, pos = [], 2
+    data = p.stdout
+    while len(fields) < 3:
+        while data[pos:pos + 1].isspace():
+            pos += 1
+        start = pos
+        while not data[pos:pos + 1].isspace():
+            pos += 1
+        fields.append(int(data[start:pos]))
+    width, height, maxval = fields
+    if maxval != 255:
+        raise RuntimeError(f"Unexpected PPM maxval {maxval} (expected 8-bit RGB)")
+    pixels = np.frombuffer(data, dtype=np.uint8, count=width * height * 3, offset=pos + 1)
+    return pixels.reshape(height, width, 3)
+
+def _ffmpeg_decode_pcm(aud_in: str, sample_rate: int = AUDIO_SAMPLE_RATE, data: bytes = None):
+    """
+    Decode any audio file to mono float32 samples in [-1, 1].
+    Pass data= to decode bytes already in memory (aud_in is then ignored).
+    """
+    source = "pipe:0" if data is not None else aud_in
+    args = ["ffmpeg", "-v", "error", "-i", source, "-ac", "1", "-ar", str(sample_rate),
+            "-f", "s16le", "-"]
+    try:
+        p = subprocess.run(args, input=data, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Audio decode timed out after {FFMPEG_TIMEOUT:.0f}s")
+    if p.returncode != 0:
+        raise RuntimeError(f"Could not decode audio: {(p.stderr or b'').decode(errors='replace')[:300]}")
+    return np.frombuffer(p.stdout, dtype="<i2").astype(np.float32) / 32768.0
+
+def _mouth_envelope(samples, sample_rate: int, fps: int, levels: int):
+    """
+    Per-frame mouth-open level (0 .. levels-1) from the audio loudness.
+    RMS per video frame, normalized to the loud end of the clip, lightly smoothed
+    so the jaw does not flicker, with a small gate so breaths keep the mouth shut.
+    """
+    hop = sample_rate // fps
+    n_frames = max(1, -(-len(samples) // hop))
+    padded = np.zeros(n_frames * hop, dtype=np.float32)
+    padded[:len(samples)] = samples
+    rms = np.sqrt(np.mean(padded.reshape(n_frames, hop) ** 2, axis=1))
+
+    ref = np.percentile(rms, 95) if rms.any() else 1.0
+    env = np.clip(rms / max(ref, 1e-6), 0.0, 1.0)
+    env = np.convolve(env, np.array([0.25, 0.5, 0.25], dtype=np.float32), mode="same")
+    env[env < 0.12] = 0.0
+    return np.rint(env * (levels - 1)).astype(np.intp)
+
+def _parse_mouth_box(spec: str):
+    try:
+        cx, cy, bw, bh = (float(v) for v in spec.split(","))
+        return cx, cy, bw, bh
+    except ValueError:
+        print("Bad AVATAR_MOUTH_BOX; using default.")
+        return 0.5, 0.62, 0.18, 0.06
+
+def _mouth_states(img, levels: int, box: str = AVATAR_MOUTH_BOX):
+    """
+    Precompute `levels` frames from closed to open by dropping the jaw under the
+    mouth line (a vertical remap that fades out toward the chin and the cheeks)
+    and shading the gap that opens between the lips.
+    """
+    height, width, _ = img.shape
+    fx, fy, fw, fh = _parse_mouth_box(box)
+    cx, cy = fx * width, fy * height
+    bw, bh = max(fw * width, 2.0), max(fh * height, 2.0)
+
+    xs = np.arange(width, dtype=np.float32)
+    ys = np.arange(height, dtype=np.float32)[:, None]
+
+    # 1 at the mouth center, fading to 0 at the cheeks (raised cosine)
+    u = np.clip((xs - cx) / (bw * 0.8), -1.0, 1.0)
+    across = 0.5 * (1.0 + np.cos(np.pi * u))
+
+    # Rows under the mouth line move down; the shift fades out toward the chin
+    jaw_span = max(3.0 * bh, 1.0)
+    down = np.clip((ys - cy) / jaw_span, 0.0, 1.0)
+    below = (ys >= cy).astype(np.float32)
+    lip_core = np.clip((across - 0.3) / 0.4, 0.0, 1.0)
+
+    base = img.astype(np.float32)
+    dark = np.array([40.0, 18.0, 22.0], dtype=np.float32)
+    col_idx = np.arange(width)[None, :]
+
+    states = [img]
+    for k in range(1, levels):
+        drop = (k / (levels - 1)) * bh * 0.6
+        disp = drop * (1.0 - down) * below * across             # (H, W)
+        src = ys - disp
+        src_rows = np.clip(np.rint(src), 0, height - 1).astype(np.intp)
+        frame = base[src_rows, col_idx]
+
+        # Pixels pulled from above the mouth line form the open mouth
+        gap = ((src < cy) & (ys >= cy)).astype(np.float32) * lip_core
+        alpha = (gap * 0.85)[..., None]
+        frame = frame * (1.0 - alpha) + dark * alpha
+        states.append(np.clip(frame, 0, 255).astype(np.uint8))
+    return states
+
+def _encode_raw_frames(frames, width: int, height: int, aud_in: str, out_path: str, fps: int = TALKING_FPS) -> bool:
+    """Pipe raw RGB frames (an iterable of bytes) into FFmpeg and mux with the audio."""
+    args = [
+        "ffmpeg", "-y", "-v", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps),
+        "-i", "-",
+        "-i", aud_in,
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-c:a", "aac",
+        "-b:a", "192k",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        "-shortest",
+        out_path,
+    ]
+    job = _FFMPEG_POOL.run(args, feed=frames, label="talking head")
+    if job["status"] == "ok" and os.path.exists(out_path):
+        return True
+    print("FFmpeg failed (", job["status"], "return code", job["returncode"], "):")
+    print(job["stderr"][:2000])
+    return False
+
+def talking_head_video(image_url_or_path: str, mp3_path_or_url: str, out_path=None):
+    """
+    Render a lip-flap MP4 locally: audio loudness drives a handful of precomputed
+    jaw positions of the avatar image. No GPU, no D-ID, no public audio URL.
+    Returns the MP4 path, or None so callers can fall back to the still video.
+    """
+    if np is None:
+        print("NumPy not installed; talking-head renderer unavailable.")
+        return None
+    if out_path is None:
+        out_path = _ffmpeg_output_path("talk")
+
+    started = time.time()
+    try:
+        local_audio = _ensure_local_audio(mp3_path_or_url)
+        img = _ffmpeg_decode_image(image_url_or_path)
+        samples = _ffmpeg_decode_pcm(local_audio)
+
+        levels = _mouth_envelope(samples, AUDIO_SAMPLE_RATE, TALKING_FPS, TALKING_LEVELS)
+        states = [s.tobytes() for s in _mouth_states(img, TALKING_LEVELS)]
+        height, width, _ = img.shape
+
+        if not _encode_raw_frames((states[i] for i in levels), width, height, local_audio, out_path):
+            return None
+    except (RuntimeError, OSError) as e:
+        # OSError covers FFmpeg missing from PATH
+        print("Talking head:", e)
+        return None
+    took = time.time() - started
+    audio_secs = len(samples) / AUDIO_SAMPLE_RATE
+    print(f"Talking-head video: {out_path} ({audio_secs:.1f}s audio in {took:.1f}s)")
+    return _finished_video(out_path)
+
+def local_avatar_video(image_url: str, mp3_path_or_url: str):
+    """Best local render: talking head first, still image if that is not possible."""
+    for img in [c for c in (image_url, DEFAULT_IMAGE_URL) if c]:
+        result = talking_head_video(img, mp3_path_or_url)
+        if result:
+            return result
+    return fallback_ffmpeg_still_video(image_url, mp3_path_or_url)
+
+# --------------------------------------------------------------------
+# TTS audio cleanup (silence trim + loudness), runs before animation/upload
+# --------------------------------------------------------------------
+# Video length and D-ID billing follow audio length, so dead air at either end
+# costs render time and money. The cleaned file is keyed by a hash of the raw
+# ElevenLabs bytes: the same reply is only processed once.
+TTS_CLEANUP        = os.getenv("TTS_CLEANUP", "1") != "0"
+TTS_CACHE_DIR      = os.path.join(OUTPUT_DIR, "tts_cache")
+CLEANUP_RATE       = 44100
+CLEANUP_FRAME_SECS = 0.01    # analysis window
+CLEANUP_PAD_SECS   = 0.08    # silence kept at each end so words are not clipped
+CLEANUP_FLOOR_DB   = -40.0   # below (peak - 40 dB) counts as silence
+TARGET_RMS_DBFS    = -20.0   # loudness of the speech part after normalizing
+PEAK_LIMIT_DBFS    = -1.0
+MAX_GAIN_DB        = 20.0    # never boost/cut more than this (silence or hiss stays quiet)
+CLEANUP_VERSION    = "2"     # part of the cache key; bump when the processing changes
+TTS_CACHE_MAX      = int(os.getenv("TTS_CACHE_MAX", "200"))  # cleaned clips kept on disk
+
+def _db(x):
+    return 20.0 * np.log10(np.maximum(x, 1e-9))
+
+def _speech_bounds(samples, sample_rate: int):
+    """
+    Return (start, end, voiced) for the non-silent part plus padding; voiced is
+    False when nothing clears the gate (the whole clip is then returned).
+    Energy per 10 ms frame, compared against the clip's own peak frame so the
+    threshold works for quiet and loud voices alike.
+    """
+    hop = max(1, int(sample_rate * CLEANUP_FRAME_SECS))
+    n_frames = len(samples) // hop
+    if n_frames == 0:
+        return 0, len(samples), False
+    frames = samples[:n_frames * hop].reshape(n_frames, hop)
+    level = _db(np.sqrt(np.mean(frames ** 2, axis=1)))
+    voiced = np.flatnonzero(level > max(level.max() + CLEANUP_FLOOR_DB, -60.0))
+    if voiced.size == 0:
+        return 0, len(samples), False
+    pad = int(sample_rate * CLEANUP_PAD_SECS)
+    start = max(0, int(voiced[0]) * hop - pad)
+    end = min(len(samples), (int(voiced[-1]) + 1) * hop + pad)
+    return start, end, True
+
+def _normalize_gain_db(samples) -> float:
+    """
+    Gain that brings speech RMS to TARGET_RMS_DBFS without pushing peaks past
+    the limit, clamped to +/- MAX_GAIN_DB.
+    """
+    if samples.size == 0:
+        return 0.0
+    rms_db = float(_db(np.sqrt(np.mean(samples ** 2))))
+    peak_db = float(_db(np.max(np.abs(samples))))
+    gain = min(TARGET_RMS_DBFS - rms_db, PEAK_LIMIT_DBFS - peak_db)
+    return max(-MAX_GAIN_DB, min(MAX_GAIN_DB, gain))
+
+def _encode_pcm_mp3(samples, sample_rate: int, out_path: str) -> bool:
+    """Encode mono float samples to MP3 through FFmpeg's stdin."""
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+    args = ["ffmpeg", "-y", "-v", "error", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1",
+            "-i", "-", "-c:a", "libmp3lame", "-b:a", "128k", "-f", "mp3", out_path]
+    job = _FFMPEG_POOL.run(args, feed=[pcm], label="mp3")
+    if job["status"] == "ok" and os.path.exists(out_path):
+        return True
+    print("FFmpeg MP3 encode failed:", job["status"], job["stderr"][:400])
+    return False
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def _prune_tts_cache():
+    """
+    Keep the TTS_CACHE_MAX most recently used clips; also clear stale .part files.
+    Best-effort: files removed by a concurrent prune (or another process) are skipped.
+    """
+    try:
+        names = os.listdir(TTS_CACHE_DIR)
+    except OSError:
+        return
+    clips = []
+    for name in names:
+        path = os.path.join(TTS_CACHE_DIR, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        if name.endswith(".part"):
+            if time.time() - mtime > 3600:
+                _remove_quietly(path)
+        elif name.endswith(".mp3"):
+            clips.append((mtime, path))
+    clips.sort(reverse=True)
+    for _mtime, path in clips[TTS_CACHE_MAX:]:
+        _remove_quietly(path)
+        _remove_quietly(path + ".json")
+
+def clean_tts_audio(raw_mp3: bytes):
+    """
+    Trim leading/trailing silence and normalize loudness of TTS bytes.
+    Returns (cached_path, stats) or (None, None) if cleanup is not possible;
+    the caller then keeps the raw bytes.
+    """
+    if np is None:
+        print("NumPy not installed; skipping TTS cleanup.")
+        return None, None
+
+    digest = hashlib.sha256(CLEANUP_VERSION.encode() + raw_mp3).hexdigest()[:16]
+    os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+    cached = os.path.join(TTS_CACHE_DIR, f"tts_{digest}.mp3")
+    stats_path = cached + ".json"
+    if os.path.exists(cached) and os.path.exists(stats_path):
+        try:
+            with open(stats_path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+            os.utime(cached)  # mark as recently used for pruning
+            return cached, dict(stats, cached=True)
+        except (OSError, ValueError) as e:
+            print("TTS cache entry unreadable; rebuilding:", e)
+
+    try:
+        samples = _ffmpeg_decode_pcm("", CLEANUP_RATE, data=raw_mp3)
+    except (RuntimeError, OSError) as e:
+        print("TTS cleanup:", e)
+        return None, None
+
+    start, end, voiced = _speech_bounds(samples, CLEANUP_RATE)
+    speech = samples[start:end]
+    # No speech found: leave the level alone rather than amplify silence or hiss
+    gain_db = _normalize_gain_db(speech) if voiced else 0.0
+    speech = speech * np.float32(10.0 ** (gain_db / 20.0))
+
+    # Write to a temp name first so a half-written file never looks like a cache hit
+    tmp_path = cached + ".part"
+    try:
+        if not _encode_pcm_mp3(speech, CLEANUP_RATE, tmp_path):
+            _remove_quietly(tmp_path)
+            return None, None
+        os.replace(tmp_path, cached)
+    except OSError as e:
+        print("TTS cleanup:", e)
+        _remove_quietly(tmp_path)
+        return None, None
+
+    stats = {
+        "hash": digest,
+        "original_secs": round(len(samples) / CLEANUP_RATE, 3),
+        "trimmed_secs": round(len(speech) / CLEANUP_RATE, 3),
+        "saved_lead_secs": round(start / CLEANUP_RATE, 3),
+        "saved_tail_secs": round((len(samples) - end) / CLEANUP_RATE, 3),
+        "gain_db": round(gain_db, 2),
+    }
+    stats["saved_secs"] = round(stats["saved_lead_secs"] + stats["saved_tail_secs"], 3)
+    try:
+        with open(stats_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+    except OSError as e:
+        # The clip is still good; it just won't count as a cache hit next time
+        print("TTS cleanup: could not write stats:", e)
+    _prune_tts_cache()
+    return cached, dict(stats, cached=False)
+
+def _store_tts_audio(raw_mp3: bytes):
+    """
+    Put the cleaned TTS audio at OUTPUT_MP3 and return (cached_path, stats);
+    (None, None) means nothing was written.
+    """
+    if not TTS_CLEANUP:
+        return None, None
+    cached, stats = clean_tts_audio(raw_mp3)
+    if not cached:
+        return None, None
+    try:
+        shutil.copyfile(cached, OUTPUT_MP3)
+    except OSError as e:
+        print("TTS cleanup: could not copy cleaned audio; keeping the original:", e)
+        return None, None
+    print(f"TTS cleanup: {stats['original_secs']}s -> {stats['trimmed_secs']}s "
+          f"(saved {stats['saved_secs']}s, gain {stats['gain_db']:+.1f} dB"
+          f"{', cached' if stats.get('cached') else ''})")
+    return cached, stats
+
+def _keep_raw_tts_clip(raw_mp3: bytes):
+    """Content-addressed copy of uncleaned TTS bytes in TTS_CACHE_DIR (pruned with the cleaned clips), or None."""
+    digest = hashlib.sha256(raw_mp3).hexdigest()[:16]
+    path = os.path.join(TTS_CACHE_DIR, f"raw_{digest}.mp3")
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.part"
+    try:
+        os.makedirs(TTS_CACHE_DIR, exist_ok=True)
+        if os.path.exists(path):
+            os.utime(path)  # mark as recently used for pruning
+            return path
+        with open(tmp_path, "wb") as f:
+            f.write(raw_mp3)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("TTS: could not keep a per-reply copy:", e)
+        _remove_quietly(tmp_path)
+        return None
+    _prune_tts_cache()
+    return path
+
 # --------------------------------------------------------------------
 # D-ID animation
 # --------------------------------------------------------------------
@@ -409,29 +1334,49 @@ def _save_remote_video(url: str, talk_id: str) -> str | None:
                 if chunk:
                     f.write(chunk)
         print("D-ID video saved locally:", local_path)
-        return local_path
+        return _finished_video(local_path)
     except Exception as e:
         print("Could not save D-ID video locally:", e)
         return None
 
-def animate_avatar_did(image_url, audio_url):
+def _notify(on_status, status: str, **info):
+    """Call an optional progress callback; a broken callback must not break the render."""
+    if on_status is None:
+        return
+    try:
+        on_status(status, info)
+    except Exception as e:
+        print("Status callback error:", e)
+
+def animate_avatar_did(image_url, audio_url, on_status=None):
     """
     If audio_url is a public https .mp3, call D-ID and try to save the result locally.
-    Otherwise (no https .mp3), if local output.mp3 exists, build a still-image video.
+    Otherwise render locally (talking head, or a still-image video if that fails):
+    audio_url may be a local MP3 path, else the local output.mp3 is used.
     Returns a local file path (preferred) or a remote D-ID URL, or None.
+
+    on_status, if given, is called as on_status(status, info_dict) while the D-ID
+    talk moves through "queued" -> "rendering" -> "done", or "fallback" when the
+    local FFmpeg path is taken. "failed" (with a reason) is sent whenever None is
+    returned. The GUI uses it to stream progress.
     """
     if not _is_https_mp3(audio_url):
-        if os.path.exists(OUTPUT_MP3):
-            print("No https .mp3; using local output.mp3 with FFmpeg fallback.")
-            return fallback_ffmpeg_still_video(image_url or DEFAULT_IMAGE_URL, OUTPUT_MP3)
+        local_mp3 = audio_url if (audio_url and os.path.isfile(audio_url)) else OUTPUT_MP3
+        if os.path.exists(local_mp3):
+            print(f"No https .mp3; using {local_mp3} with local renderer.")
+            _notify(on_status, "fallback", reason="no https .mp3")
+            return local_avatar_video(image_url or DEFAULT_IMAGE_URL, local_mp3)
         print("No https .mp3 and no local output.mp3 found.")
+        _notify(on_status, "failed", reason="no audio to animate")
         return None
 
     if not DID_AUTH:
         print("Missing DID_AUTH")
+        _notify(on_status, "failed", reason="missing DID_AUTH")
         return None
     if not (image_url and isinstance(image_url, str) and image_url.lower().startswith("https://")):
         print("D-ID requires an https image URL.")
+        _notify(on_status, "failed", reason="D-ID requires an https image URL")
         return None
 
     basic = base64.b64encode(DID_AUTH.encode()).decode()
@@ -442,41 +1387,63 @@ def animate_avatar_did(image_url, audio_url):
         r = requests.post("https://api.d-id.com/talks", headers=headers, json=payload, timeout=60)
     except requests.exceptions.RequestException as e:
         print("D-ID network error:", e)
-        return fallback_ffmpeg_still_video(image_url, audio_url)
+        _notify(on_status, "fallback", reason="D-ID network error")
+        return local_avatar_video(image_url, audio_url)
 
     if r.status_code >= 500:
-        print("D-ID server error (5xx); using FFmpeg fallback.")
-        return fallback_ffmpeg_still_video(image_url, audio_url)
+        print("D-ID server error (5xx); using local renderer.")
+        _notify(on_status, "fallback", reason="D-ID server error")
+        return local_avatar_video(image_url, audio_url)
 
     if not r.ok:
         print("D-ID create failed:", r.status_code, (r.text or "")[:400])
+        _notify(on_status, "failed", reason=f"D-ID create failed ({r.status_code})")
         return None
 
     talk_id = r.json().get("id") or r.json().get("talk_id")
     print("D-ID talk created:", talk_id)
+    _notify(on_status, "queued", talk_id=talk_id)
 
     # Poll for completion
     start = time.time()
+    last_status = None
     while time.time() - start < 240:
+        if _cancelled():
+            print("D-ID wait cancelled:", talk_id)
+            _notify(on_status, "failed", talk_id=talk_id, reason="cancelled")
+            return None
         try:
             g = requests.get(f"https://api.d-id.com/talks/{talk_id}", headers=headers, timeout=30)
         except requests.exceptions.RequestException as e:
             print("D-ID poll error:", e)
-            break
+            _notify(on_status, "failed", talk_id=talk_id, reason="D-ID poll error")
+            return None
         if g.ok:
             data = g.json()
             status = data.get("status")
+            if status and status != last_status:
+                last_status = status
+                if status in ("created", "started"):
+                    _notify(on_status, "rendering", talk_id=talk_id, did_status=status,
+                            elapsed=round(time.time() - start, 1))
             if status == "done":
                 url = data.get("result_url") or data.get("video_url")
                 print("D-ID video URL:", url)
                 local = _save_remote_video(url, talk_id)
+                _notify(on_status, "done", talk_id=talk_id, url=url,
+                        elapsed=round(time.time() - start, 1))
                 return local or url
             if status in ("error", "failed"):
                 print("D-ID render failed:", data)
+                err = data.get("error") or {}
+                detail = err.get("description") if isinstance(err, dict) else str(err)
+                _notify(on_status, "failed", talk_id=talk_id,
+                        reason=f"D-ID render {status}" + (f": {detail}" if detail else ""))
                 return None
         time.sleep(3)
 
     print("D-ID render timed out.")
+    _notify(on_status, "failed", talk_id=talk_id, reason="D-ID render timed out")
     return None
 
 # --------------------------------------------------------------------
@@ -575,6 +1542,192 @@ def upload_output_mp3_and_set_default():
         print("Upload error:", e)
         return None
 
+# --------------------------------------------------------------------
+# FAQ pre-render index (offline warm-up + fuzzy lookup)
+# --------------------------------------------------------------------
+# Most traffic is the same few dozen questions. `python grok.py warm faq.txt`
+# runs the full pipeline once per line and keeps answer, MP3 and MP4 under
+# OUTPUT_DIR/faq. /full then answers close matches straight from that index.
+FAQ_DIR             = os.path.join(OUTPUT_DIR, "faq")
+FAQ_INDEX_PATH      = os.path.join(FAQ_DIR, "faq_index.json")
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.8"))
+
+# Words that may be added or dropped without changing the question. Every other
+# word must appear in both questions, so "name"/"game" or "do"/"did" never match.
+FAQ_FILLER_WORDS = frozenset("""
+    please pls the a an so and hey hi hello um uh ok okay well just
+""".split())
+
+# In-memory copy of faq_index.json, refreshed when the file changes on disk
+# (the warm-up usually runs in a separate process from the GUI).
+_FAQ = {"mtime": None, "entries": {}}
+_FAQ_LOCK = threading.Lock()
+
+def normalize_question(text: str) -> str:
+    """Case-fold, drop punctuation and collapse whitespace; works for Persian too."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    kept = [ch if (ch.isalnum() or ch.isspace()) else " " for ch in text]
+    return " ".join("".join(kept).split())
+
+def _faq_entries() -> dict:
+    try:
+        mtime = os.path.getmtime(FAQ_INDEX_PATH)
+    except OSError:
+        return {}
+    if mtime != _FAQ["mtime"]:
+        with _FAQ_LOCK:
+            if mtime != _FAQ["mtime"]:
+                try:
+                    with open(FAQ_INDEX_PATH, "r", encoding="utf-8") as f:
+                        entries = json.load(f)
+                except (OSError, ValueError) as e:
+                    print("Could not read FAQ index:", e)
+                    return _FAQ["entries"]
+                _FAQ["entries"], _FAQ["mtime"] = entries, mtime
+    return _FAQ["entries"]
+
+def _save_faq_entries(entries: dict):
+    os.makedirs(FAQ_DIR, exist_ok=True)
+    tmp = FAQ_INDEX_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, FAQ_INDEX_PATH)
+    with _FAQ_LOCK:
+        _FAQ["entries"], _FAQ["mtime"] = entries, os.path.getmtime(FAQ_INDEX_PATH)
+
+def question_match_score(a: str, b: str) -> float:
+    """
+    Similarity of two normalized questions, compared word by word.
+    0.0 unless both use exactly the same non-filler words; otherwise the difflib
+    ratio over the word lists (so word order and filler words lower it a little).
+
+    >>> q = normalize_question
+    >>> question_match_score(q("Where do you live?"), q("where do you live"))
+    1.0
+    >>> question_match_score(q("Please, where do you live?"), q("Where do you live?")) >= 0.8
+    True
+    >>> question_match_score(q("What is your game?"), q("What is your name?"))
+    0.0
+    >>> question_match_score(q("Where did you live?"), q("Where do you live?"))
+    0.0
+    >>> question_match_score(q("where do you love"), q("Where do you live?"))
+    0.0
+    >>> question_match_score(q("And where do you live now?"), q("Where do you live?"))
+    0.0
+    """
+    wa, wb = a.split(), b.split()
+    if {w for w in wa if w not in FAQ_FILLER_WORDS} != {w for w in wb if w not in FAQ_FILLER_WORDS}:
+        return 0.0
+    return difflib.SequenceMatcher(None, wa, wb, autojunk=False).ratio()
+
+def _faq_file(stored: str) -> str:
+    """
+    Resolve a path from faq_index.json. Entries hold names relative to FAQ_DIR so
+    the index keeps working if OUTPUT_DIR or the repo moves; older absolute
+    entries are mapped into FAQ_DIR by file name.
+    """
+    name = os.path.basename(stored) if os.path.isabs(stored or "") else (stored or "")
+    return os.path.join(FAQ_DIR, name) if name else ""
+
+def _faq_files_exist(entry: dict) -> bool:
+    return all(os.path.isfile(_faq_file(entry.get(k))) for k in ("mp3", "video"))
+
+def faq_lookup(question: str, threshold: float = None, exact_only: bool = False):
+    """
+    Return the pre-rendered entry for a question (with its match score), or None.
+    Exact match on the normalized text first; otherwise the best word-level
+    question_match_score at or above the threshold. A wrong canned answer is
+    worse than a live one, so near-misses on a single word never match.
+    exact_only=True skips the fuzzy step (used mid-conversation, where a
+    similar-looking follow-up usually depends on earlier turns).
+    """
+    entries = _faq_entries()
+    if not entries:
+        return None
+    threshold = FAQ_MATCH_THRESHOLD if threshold is None else threshold
+    key = normalize_question(question)
+    if not key:
+        return None
+
+    hit, score = entries.get(key), 1.0
+    if hit is None and not exact_only:
+        best, score = None, 0.0
+        for norm, entry in entries.items():
+            ratio = question_match_score(key, norm)
+            if ratio > score:
+                best, score = entry, ratio
+        hit = best if score >= threshold else None
+    if not hit or not _faq_files_exist(hit):
+        return None
+    return dict(hit, mp3=_faq_file(hit["mp3"]), video=_faq_file(hit["video"]), score=round(score, 3))
+
+def prerender_faq(questions, image_url: str = None, upload: bool = True, force: bool = False):
+    """
+    Run chat -> TTS -> animate once per question and store the results in the FAQ index.
+    Questions already in the index are skipped unless force=True. Returns the number rendered.
+    """
+    if not groq_client:
+        print("Missing GROQ_API_KEY (or groq package); nothing to pre-render.")
+        return 0
+    voice_id = load_voice_id()
+    if not voice_id:
+        print("No voice_id; clone or register a voice first.")
+        return 0
+    image_url = image_url or DEFAULT_IMAGE_URL
+    entries = dict(_faq_entries())
+    os.makedirs(FAQ_DIR, exist_ok=True)
+    done = 0
+
+    for question in questions:
+        question = question.strip()
+        key = normalize_question(question)
+        if not key:
+            continue
+        if key in entries and not force and _faq_files_exist(entries[key]):
+            print("Already rendered:", question)
+            continue
+
+        print("Pre-rendering:", question)
+        answer = chat_like_me(question)
+        if not answer:
+            print("No answer; skipping.")
+            continue
+        if not generate_tts(voice_id, answer):
+            print("TTS failed; skipping.")
+            continue
+        audio_url = upload_output_mp3_and_set_default() if upload else ""
+        video = animate_avatar_did(image_url, audio_url or "")
+        if not (isinstance(video, str) and os.path.exists(video)):
+            print("No local video; skipping.")
+            continue
+
+        # Keep our own copies: output.mp3 is overwritten by the next TTS call,
+        # and the video should not show up in Recent Videos.
+        stem = "faq_" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+        mp3_path = os.path.join(FAQ_DIR, stem + ".mp3")
+        mp4_path = os.path.join(FAQ_DIR, stem + ".mp4")
+        shutil.copyfile(OUTPUT_MP3, mp3_path)
+        shutil.move(video, mp4_path)
+        if os.path.exists(poster_path_for(video)):
+            os.remove(poster_path_for(video))
+
+        entries[key] = {
+            "question": question,
+            "answer": answer,
+            "mp3": os.path.basename(mp3_path),     # relative to FAQ_DIR
+            "video": os.path.basename(mp4_path),
+            "created": datetime.now().isoformat(timespec="seconds"),
+        }
+        _save_faq_entries(entries)
+        done += 1
+
+    print(f"FAQ index: {done} rendered, {len(entries)} total in {FAQ_INDEX_PATH}")
+    return done
+
+def _read_question_file(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
 # --------------------------------------------------------------------
 # Simple CLI menu (handy for quick tests)
 # --------------------------------------------------------------------
@@ -590,14 +1743,16 @@ def main():
         print("3. Animate avatar (D-ID or local fallback)")
         print("4. Run full pipeline")
         print("5. Exit")
-        print("6. Clone voice from sample")
+        print("6. Clone voice from samples (reuses the voice if samples are unchanged)")
         print("7. Paste a new ELEVENLABS_API_KEY (runtime)")
         print("8. Upload output.mp3 to GitHub Release (set as default)")
+        print("9. Animate locally from output.mp3 (talking head, no D-ID)")
+        print("10. Pre-render FAQ answers from a question file")
         choice = input("\nSelect an option: ").strip()
 
         if choice == "1":
             q = input("Question: ")
-            print("Reply:", chat_like_me(q))
+            print("Reply:", chat_like_me(q, session_id="cli"))
 
         elif choice == "2":
             t = input("Text: ")
@@ -624,7 +1779,7 @@ def main():
 
         elif choice == "4":
             q = input("Ask a question: ")
-            reply = chat_like_me(q)
+            reply = chat_like_me(q, session_id="cli")
             print("Reply:", reply)
             mp3 = generate_tts(voice_id, reply)
             if mp3:
@@ -648,7 +1803,8 @@ def main():
 
         elif choice == "6":
             new_name = input("Name for cloned voice (default MyVoice): ").strip() or "MyVoice"
-            v = clone_voice(new_name)
+            force = input("Clone again even if samples are unchanged? [y/N]: ").strip().lower() == "y"
+            v = clone_voice(new_name, force=force)
             if v:
                 voice_id = load_voice_id()
 
@@ -659,11 +1815,32 @@ def main():
         elif choice == "8":
             upload_output_mp3_and_set_default()
 
+        elif choice == "9":
+            if not os.path.exists(OUTPUT_MP3):
+                print("No local output.mp3. Use option 2 first.")
+                continue
+            img = input(f"Image URL or path [Enter for default: {DEFAULT_IMAGE_URL or '(none)'}]: ").strip() or DEFAULT_IMAGE_URL
+            local_avatar_video(img, OUTPUT_MP3)
+
+        elif choice == "10":
+            path = input("Question file (one question per line): ").strip().strip('"')
+            if not os.path.exists(path):
+                print("File not found.")
+                continue
+            auto = input("Upload each MP3 to GitHub Release for D-ID? [y/N]: ").strip().lower()
+            prerender_faq(_read_question_file(path), upload=(auto == "y"))
+
         else:
             print("Invalid choice.")
 
 if __name__ == "__main__":
-    main()
+    # Offline FAQ warm-up: python grok.py warm questions.txt [--no-upload] [--force]
+    if len(sys.argv) >= 3 and sys.argv[1] == "warm":
+        prerender_faq(_read_question_file(sys.argv[2]),
+                      upload="--no-upload" not in sys.argv,
+                      force="--force" in sys.argv)
+    else:
+        main()
 
 
 